@@ -5,17 +5,26 @@ Unified interface for converting supplier XML feeds to CSV format and managing B
 """
 
 import streamlit as st
-import urllib.request
-import xml.etree.ElementTree as ET
-import csv
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree as LET
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import functools
 import io
 import re
+import html
 import json
+import orjson
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
+import sys
 import time
 import hmac
-from urllib import parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 # Supplier configurations
@@ -57,95 +66,210 @@ SUPPLIERS = {
     }
 }
 
+# Display names of the parser types
+FORMAT_LABELS = {
+    "iof_format": "IOF 3.0",
+    "soteshop_format": "Soteshop",
+    "maxima_format": "Maxima"
+}
+
+# Product columns, in CSV export order
+FIELDNAMES = [
+    'product_id', 'ean', 'name', 'producer', 'category', 'category_path',
+    'version', 'price_gross', 'price_net', 'vat', 'currency', 'stock',
+    'url', 'description'
+]
+
+# Columns with few distinct values, stored as pandas categoricals
+CATEGORY_COLUMNS = ['producer', 'category', 'vat', 'currency']
+
+# Cleaned descriptions are cut to this many characters
+DESCRIPTION_MAX_LEN = 500
+
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_ENTITY_MAX_LEN = 33  # longest HTML5 entity, '&CounterClockwiseContourIntegral;'
+
+# Lookups used once per IOF product, compiled at import time
+_XML_NS = 'http://www.w3.org/XML/1998/namespace'
+_LANG_ATTR = '{%s}lang' % _XML_NS
+_XP_NAME_POL = LET.XPath('name[@xml:lang="pol"]', namespaces={'xml': _XML_NS})
+_XP_SIZE_PRICES = LET.XPath('size/price[1]')
+_XP_SIZE_STOCKS = LET.XPath('size/stock[1]')
+
+
+# Variants of a product often share the same name; only these short texts are cached,
+# since keying on whole descriptions would keep large strings alive for the process lifetime
+@functools.lru_cache(maxsize=4096)
+def _clean_name(text: str) -> str:
+    """Clean a short text in full."""
+    return ' '.join(html.unescape(_TAG_RE.sub('', text)).split())
 
-def clean_html(text: str) -> str:
-    """Remove HTML tags and clean text."""
+
+def clean_html(text: str, max_len: Optional[int] = None) -> str:
+    """Remove HTML tags, decode entities and collapse whitespace.
+    
+    With max_len, only the head of the text is cleaned and the result is truncated to max_len.
+    """
     if not text:
         return ''
-    text = re.sub(r'<[^>]+>', '', text)
-    text = text.replace('&gt;', '>').replace('&lt;', '<').replace('&amp;', '&')
-    text = text.replace('&nbsp;', ' ').replace('&quot;', '"')
-    text = ' '.join(text.split())
-    return text.strip()
+    if max_len is None:
+        return _clean_name(text)
+    
+    # Markup often outweighs the text it wraps, so strip tags from a generous raw head
+    raw = text[:max_len * 8]
+    truncated = len(raw) < len(text)
+    if truncated:
+        # Drop a tag left open by the cut so its attributes don't read as text
+        cut = raw.find('<', raw.rfind('>') + 1)
+        if cut != -1:
+            raw = raw[:cut]
+    
+    stripped = _TAG_RE.sub('', raw)
+    head = stripped[:max_len * 2]
+    cleaned = ' '.join(html.unescape(head).split())
+    # The cuts may split an entity or whitespace run; fall back unless that tail lies past max_len
+    if (truncated or len(head) < len(stripped)) and len(cleaned) < max_len + _ENTITY_MAX_LEN:
+        cleaned = ' '.join(html.unescape(_TAG_RE.sub('', text)).split())
+    return cleaned[:max_len]
 
 
-def extract_text(element, path: str, default: str = '') -> str:
-    """Safely extract text from XML element."""
-    if element is None:
-        return default
-    found = element.find(path)
-    if found is not None and found.text:
-        return found.text.strip()
+def _to_int(value: str) -> int:
+    """Convert an integer string, falling back to float parsing for values like '3.0'."""
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def parse_stock(value: str) -> int:
+    """Convert a stock quantity to int; unparseable values count as 0."""
+    try:
+        return _to_int(value)
+    except (ValueError, OverflowError):
+        return 0
+
+
+def child_map(element) -> Dict:
+    """Map each child tag to its first occurrence, so lookups don't rescan the children."""
+    return {child.tag: child for child in reversed(element)}
+
+
+def attr(element, name: str, default: str = '') -> str:
+    """Read an attribute of an optional element."""
+    return element.get(name, default) if element is not None else default
+
+
+def child_text(kids: Dict, tag: str, default: str = '') -> str:
+    """Stripped text of a child from child_map(), or default if it is missing or empty."""
+    child = kids.get(tag)
+    if child is not None and child.text:
+        return child.text.strip()
     return default
 
 
-def extract_cdata(element, tag: str, lang: str = 'pol') -> str:
+def extract_cdata(element, tag: str, lang: str = 'pol', max_len: Optional[int] = None) -> str:
     """Extract CDATA content from description tags with language attribute."""
     if element is None:
         return ''
     
     for child in element.findall(tag):
-        if child.get('{http://www.w3.org/XML/1998/namespace}lang') == lang:
+        if child.get(_LANG_ATTR) == lang:
             if child.text:
-                return clean_html(child.text)
+                return clean_html(child.text, max_len)
     
     first = element.find(tag)
     if first is not None and first.text:
-        return clean_html(first.text)
+        return clean_html(first.text, max_len)
     
     return ''
 
 
-def parse_iof_format(xml_data: bytes) -> List[Dict]:
-    """Parse IOF format XML (Scandinavian Baby, Kids Inspirations, Solution BC)."""
-    root = ET.fromstring(xml_data)
-    products = []
+def new_columns() -> Dict[str, List]:
+    """Create an empty column-oriented product buffer (one list per field)."""
+    return {field: [] for field in FIELDNAMES}
+
+
+def iter_products(stream) -> Iterator:
+    """Stream <product> elements from a file-like source, freeing each once processed.
     
-    for prod in root.findall('.//product'):
+    A product is cleared as soon as the caller advances, so all reads from it
+    (and from helpers such as child_text/extract_cdata) must happen in the loop body.
+    """
+    context = LET.iterparse(stream, events=('end',), tag='product', huge_tree=False, remove_blank_text=True)
+    for _, prod in context:
+        yield prod
+        # Drop the processed product and its already-handled siblings so the tree never grows
+        prod.clear()
+        while prod.getprevious() is not None:
+            del prod.getparent()[0]
+
+
+def detect_xml_format(stream) -> Optional[str]:
+    """Detect parser type from the root tag and the first <product>, without parsing the rest."""
+    root_tag = None
+    
+    for event, elem in LET.iterparse(stream, events=('start', 'end')):
+        if root_tag is None:
+            root_tag = elem.tag
+        elif event == 'start' and elem.tag == 'product':
+            if root_tag == 'offer' and elem.getparent().tag == 'products':
+                return "soteshop_format"
+            if root_tag != 'products':
+                return "maxima_format"
+        elif event == 'start' and elem.tag == 'producer' and elem.getparent().tag == 'product':
+            return "iof_format"
+        elif event == 'end' and elem.tag == 'product':
+            # First product under <products> closed without a <producer>
+            return "maxima_format"
+    
+    return None
+
+
+def parse_iof_stream(stream) -> Dict[str, List]:
+    """Parse IOF format XML (Scandinavian Baby, Kids Inspirations, Solution BC) from a file-like stream."""
+    columns = new_columns()
+    
+    for prod in iter_products(stream):
         product_id = prod.get('id', '')
         ean = prod.get('code_on_card', '')
-        vat = prod.get('vat', '23.0')
-        currency = prod.get('currency', 'PLN')
-        
-        producer_elem = prod.find('producer')
-        producer = producer_elem.get('name', '') if producer_elem is not None else ''
+        # Low-cardinality fields are interned so rows share one string per value
+        vat = sys.intern(prod.get('vat', '23.0'))
+        currency = sys.intern(prod.get('currency', 'PLN'))
         
-        category_elem = prod.find('category')
-        category = category_elem.get('name', '') if category_elem is not None else ''
+        kids = child_map(prod)
+        producer = sys.intern(attr(kids.get('producer'), 'name'))
+        category = sys.intern(attr(kids.get('category'), 'name'))
+        category_path = attr(kids.get('category_idosell'), 'path')
+        url = attr(kids.get('card'), 'url')
         
-        category_idosell = prod.find('category_idosell')
-        category_path = category_idosell.get('path', '') if category_idosell is not None else ''
-        
-        card_elem = prod.find('card')
-        url = card_elem.get('url', '') if card_elem is not None else ''
-        
-        desc_elem = prod.find('description')
+        desc_elem = kids.get('description')
         name_pol = extract_cdata(desc_elem, 'name', 'pol')
-        long_desc = extract_cdata(desc_elem, 'long_desc', 'pol')
+        long_desc = extract_cdata(desc_elem, 'long_desc', 'pol', DESCRIPTION_MAX_LEN)
         
         version_elem = desc_elem.find('version') if desc_elem is not None else None
         version = ''
         if version_elem is not None:
-            version_name = version_elem.find('name[@{http://www.w3.org/XML/1998/namespace}lang="pol"]')
-            if version_name is not None and version_name.text:
-                version = version_name.text.strip()
+            version_names = _XP_NAME_POL(version_elem)
+            if version_names and version_names[0].text:
+                version = version_names[0].text.strip()
             elif version_elem.get('name'):
                 version = version_elem.get('name')
         
         price_gross = ''
         price_net = ''
-        stock_quantity = '0'
+        stock = 0
         
-        price_elem = prod.find('price')
+        price_elem = kids.get('price')
         if price_elem is not None:
             price_gross = price_elem.get('gross', '')
             price_net = price_elem.get('net', '')
         
-        stock_elem = prod.find('stock')
+        stock_elem = kids.get('stock')
         if stock_elem is not None:
-            stock_quantity = stock_elem.get('quantity', '0')
+            stock = parse_stock(stock_elem.get('quantity', '0'))
         
-        sizes_elem = prod.find('sizes')
+        sizes_elem = kids.get('sizes')
         if sizes_elem is not None:
             size_price = sizes_elem.find('price')
             if size_price is not None:
@@ -153,165 +277,253 @@ def parse_iof_format(xml_data: bytes) -> List[Dict]:
                 price_net = size_price.get('net', price_net)
             
             size_stock = sizes_elem.find('stock')
-            if size_stock is not None:
-                stock_quantity = size_stock.get('quantity', stock_quantity)
+            if size_stock is not None and size_stock.get('quantity') is not None:
+                stock = parse_stock(size_stock.get('quantity'))
             
-            for size in sizes_elem.findall('size'):
-                size_price = size.find('price')
-                if size_price is not None and not price_gross:
+            # Fall back to the first size that carries a gross price
+            if not price_gross:
+                for size_price in _XP_SIZE_PRICES(sizes_elem):
                     price_gross = size_price.get('gross', price_gross)
                     price_net = size_price.get('net', price_net)
-                
-                size_stock = size.find('stock')
-                if size_stock is not None:
-                    qty = size_stock.get('quantity', '0')
-                    try:
-                        stock_quantity = str(int(float(stock_quantity)) + int(float(qty)))
-                    except (ValueError, TypeError):
-                        pass
-        
-        products.append({
-            'product_id': product_id,
-            'ean': ean,
-            'name': name_pol,
-            'producer': producer,
-            'category': category,
-            'category_path': category_path,
-            'version': version,
-            'price_gross': price_gross,
-            'price_net': price_net,
-            'vat': vat,
-            'currency': currency,
-            'stock': stock_quantity,
-            'url': url,
-            'description': long_desc[:500]
-        })
-    
-    return products
-
-
-def parse_soteshop_format(xml_data: bytes) -> List[Dict]:
-    """Parse Soteshop format XML (Jabadabadoo, B.toys, Bristle Blocks)."""
-    root = ET.fromstring(xml_data)
-    products = []
-    
-    for prod in root.findall('.//product'):
+                    if price_gross:
+                        break
+            
+            # Sum size stocks onto the base quantity; unparseable sizes add nothing
+            for size_stock in _XP_SIZE_STOCKS(sizes_elem):
+                stock += parse_stock(size_stock.get('quantity', '0'))
+        
+        columns['product_id'].append(product_id)
+        columns['ean'].append(ean)
+        columns['name'].append(name_pol)
+        columns['producer'].append(producer)
+        columns['category'].append(category)
+        columns['category_path'].append(category_path)
+        columns['version'].append(version)
+        columns['price_gross'].append(price_gross)
+        columns['price_net'].append(price_net)
+        columns['vat'].append(vat)
+        columns['currency'].append(currency)
+        columns['stock'].append(stock)
+        columns['url'].append(url)
+        columns['description'].append(long_desc)
+    
+    return columns
+
+
+def parse_soteshop_stream(stream) -> Dict[str, List]:
+    """Parse Soteshop format XML (Jabadabadoo, B.toys, Bristle Blocks) from a file-like stream."""
+    columns = new_columns()
+    
+    for prod in iter_products(stream):
         product_id = prod.get('id', '')
-        ean = extract_text(prod, 'producer_code', '')
-        name = extract_text(prod, 'name', '')
-        producer = extract_text(prod, 'producer', '')
-        
-        category_elem = prod.find('category')
-        category = category_elem.text.strip() if category_elem is not None and category_elem.text else ''
-        
-        description_elem = prod.find('description')
-        description = clean_html(description_elem.text) if description_elem is not None and description_elem.text else ''
-        
-        price_elem = prod.find('price')
-        price_gross = price_elem.get('gross', '0') if price_elem is not None else '0'
-        price_net = price_elem.get('net', '0') if price_elem is not None else '0'
-        
-        stock_elem = prod.find('stock')
-        stock = stock_elem.get('quantity', '0') if stock_elem is not None else '0'
-        
-        url = extract_text(prod, 'url', '')
-        
-        products.append({
-            'product_id': product_id,
-            'ean': ean,
-            'name': name,
-            'producer': producer,
-            'category': category,
-            'category_path': '',
-            'version': '',
-            'price_gross': price_gross,
-            'price_net': price_net,
-            'vat': '23.0',
-            'currency': 'PLN',
-            'stock': stock,
-            'url': url,
-            'description': description[:500]
-        })
-    
-    return products
-
-
-def parse_maxima_format(xml_data: bytes) -> List[Dict]:
-    """Parse Maxima format XML."""
-    root = ET.fromstring(xml_data)
-    products = []
-    
-    for prod in root.findall('.//product'):
+        kids = child_map(prod)
+        ean = child_text(kids, 'producer_code')
+        name = child_text(kids, 'name')
+        producer = sys.intern(child_text(kids, 'producer'))
+        category = sys.intern(child_text(kids, 'category'))
+        
+        description_elem = kids.get('description')
+        description = clean_html(description_elem.text, DESCRIPTION_MAX_LEN) if description_elem is not None and description_elem.text else ''
+        
+        price_elem = kids.get('price')
+        price_gross = attr(price_elem, 'gross', '0')
+        price_net = attr(price_elem, 'net', '0')
+        stock = attr(kids.get('stock'), 'quantity', '0')
+        
+        url = child_text(kids, 'url')
+        
+        columns['product_id'].append(product_id)
+        columns['ean'].append(ean)
+        columns['name'].append(name)
+        columns['producer'].append(producer)
+        columns['category'].append(category)
+        columns['category_path'].append('')
+        columns['version'].append('')
+        columns['price_gross'].append(price_gross)
+        columns['price_net'].append(price_net)
+        columns['vat'].append('23.0')
+        columns['currency'].append('PLN')
+        columns['stock'].append(parse_stock(stock))
+        columns['url'].append(url)
+        columns['description'].append(description)
+    
+    return columns
+
+
+def parse_maxima_stream(stream) -> Dict[str, List]:
+    """Parse Maxima format XML from a file-like stream."""
+    columns = new_columns()
+    
+    for prod in iter_products(stream):
         product_id = prod.get('id', '')
-        ean = extract_text(prod, 'ean', '')
-        name = extract_text(prod, 'name', '')
-        producer = extract_text(prod, 'producer', '')
-        category = extract_text(prod, 'category', '')
-        description = extract_text(prod, 'description', '')
-        
-        price_gross = extract_text(prod, 'price_gross', '0')
-        price_net = extract_text(prod, 'price_net', '0')
-        stock = extract_text(prod, 'stock', '0')
-        url = extract_text(prod, 'url', '')
-        
-        products.append({
-            'product_id': product_id,
-            'ean': ean,
-            'name': name,
-            'producer': producer,
-            'category': category,
-            'category_path': '',
-            'version': '',
-            'price_gross': price_gross,
-            'price_net': price_net,
-            'vat': '23.0',
-            'currency': 'PLN',
-            'stock': stock,
-            'url': url,
-            'description': clean_html(description)[:500]
-        })
-    
-    return products
-
-
-def fetch_and_parse(supplier_name: str, config: Dict) -> Tuple[List[Dict], Optional[str]]:
-    """Fetch XML and parse into products."""
-    try:
-        with st.spinner(f'Fetching XML from {supplier_name}...'):
-            with urllib.request.urlopen(config['url'], timeout=30) as response:
-                xml_data = response.read()
-        
-        with st.spinner(f'Parsing {supplier_name} products...'):
-            if config['parser'] == 'iof_format':
-                products = parse_iof_format(xml_data)
-            elif config['parser'] == 'soteshop_format':
-                products = parse_soteshop_format(xml_data)
-            elif config['parser'] == 'maxima_format':
-                products = parse_maxima_format(xml_data)
-            else:
-                return [], f"Unknown parser: {config['parser']}"
+        # Every Maxima field is child text, so read the texts in one pass (first occurrence wins)
+        texts = {child.tag: child.text for child in reversed(prod)}
+        ean = (texts.get('ean') or '').strip()
+        name = (texts.get('name') or '').strip()
+        producer = sys.intern((texts.get('producer') or '').strip())
+        category = sys.intern((texts.get('category') or '').strip())
+        description = (texts.get('description') or '').strip()
+        
+        price_gross = (texts.get('price_gross') or '0').strip()
+        price_net = (texts.get('price_net') or '0').strip()
+        stock = (texts.get('stock') or '0').strip()
+        url = (texts.get('url') or '').strip()
+        
+        columns['product_id'].append(product_id)
+        columns['ean'].append(ean)
+        columns['name'].append(name)
+        columns['producer'].append(producer)
+        columns['category'].append(category)
+        columns['category_path'].append('')
+        columns['version'].append('')
+        columns['price_gross'].append(price_gross)
+        columns['price_net'].append(price_net)
+        columns['vat'].append('23.0')
+        columns['currency'].append('PLN')
+        columns['stock'].append(parse_stock(stock))
+        columns['url'].append(url)
+        columns['description'].append(clean_html(description, DESCRIPTION_MAX_LEN))
+    
+    return columns
+
+
+# Stream parser for each parser type
+_PARSERS = {
+    "iof_format": parse_iof_stream,
+    "soteshop_format": parse_soteshop_stream,
+    "maxima_format": parse_maxima_stream
+}
+
+
+@st.cache_resource(show_spinner=False)
+def http_session() -> requests.Session:
+    """Keep-alive session for feed downloads, shared across reruns so connections are reused."""
+    return requests.Session()
+
+
+def _conditional_get(url: str, cached: Optional[Dict]) -> Optional[requests.Response]:
+    """Open a feed URL as a stream, revalidating against the ETag/Last-Modified of the cached copy.
+    
+    Returns None when the server answers 304 Not Modified.
+    """
+    headers = {'Accept-Encoding': 'gzip'}
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    response = http_session().get(url, headers=headers, timeout=30, stream=True)
+    if response.status_code == 304 and cached:
+        response.close()
+        return None
+    response.raise_for_status()
+    return response
+
+
+def fetch_feed(url: str, parser: str, cached: Optional[Dict] = None) -> Dict:
+    """Download and parse a supplier feed into a feed-cache entry.
+    
+    Makes no Streamlit calls, so it is safe to run in worker threads.
+    Returns `cached` unchanged when the feed has not been modified.
+    """
+    response = _conditional_get(url, cached)
+    if response is None:
+        return cached
+    
+    # Parse straight off the socket (urllib3 decompresses on the fly) so parsing overlaps the download
+    with response:
+        response.raw.decode_content = True
         
-        return products, None
+        if parser not in _PARSERS:
+            raise ValueError(f"Unknown parser: {parser}")
+        products = _PARSERS[parser](response.raw)
+        
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'products': products
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def feed_cache() -> Dict[str, Dict]:
+    """Parsed feeds with their ETag/Last-Modified, shared by all sessions for conditional requests."""
+    return {}
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_products(url: str, parser: str) -> Tuple[Dict[str, List], float]:
+    """Fetch and parse a feed, memoized for 10 minutes; after that it is revalidated with the server.
+    
+    Returns the products with the time they were fetched or confirmed unchanged by the server.
+    """
+    feed = fetch_feed(url, parser, feed_cache().get(url))
+    if feed['etag'] or feed['last_modified']:
+        feed_cache()[url] = feed
+    return feed['products'], time.time()
+
+
+def fetch_and_parse(supplier_name: str, config: Dict) -> Tuple[Dict[str, List], Optional[float], Optional[str]]:
+    """Fetch XML and parse into products, reusing the cached result if the feed is unchanged."""
+    try:
+        with st.spinner(f'Fetching and parsing {supplier_name} products...'):
+            products, fetched_at = fetch_products(config['url'], config['parser'])
+            return products, fetched_at, None
         
     except Exception as e:
-        return [], str(e)
+        return {}, None, str(e)
 
 
-def create_csv(products: List[Dict]) -> str:
-    """Convert products to CSV string."""
-    output = io.StringIO()
+def fetch_all_suppliers() -> Dict[str, Tuple[Dict[str, List], Optional[float], Optional[str]]]:
+    """Fetch and parse every supplier feed concurrently, reporting each as it completes."""
+    results = {}
+    
+    with st.status(f"Fetching {len(SUPPLIERS)} supplier feeds...", expanded=True) as status:
+        with ThreadPoolExecutor(max_workers=len(SUPPLIERS)) as executor:
+            futures = {
+                executor.submit(fetch_products, config['url'], config['parser']): name
+                for name, config in SUPPLIERS.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    products, fetched_at = future.result()
+                except Exception as e:
+                    results[name] = ({}, None, str(e))
+                    st.write(f"❌ {name}: {e}")
+                    continue
+                
+                results[name] = (products, fetched_at, None)
+                st.write(f"✅ {name}: {len(products['product_id'])} products")
+        
+        status.update(label="Supplier feeds fetched", state="complete")
     
-    fieldnames = [
-        'product_id', 'ean', 'name', 'producer', 'category', 'category_path',
-        'version', 'price_gross', 'price_net', 'vat', 'currency', 'stock',
-        'url', 'description'
-    ]
+    # Report in configuration order rather than completion order
+    return {name: results[name] for name in SUPPLIERS}
+
+
+def products_frame(products: Dict[str, List]) -> pd.DataFrame:
+    """Build the products DataFrame once per parse, deriving numeric columns up front."""
+    df = pd.DataFrame(products, columns=FIELDNAMES)
+    for column in CATEGORY_COLUMNS:
+        # First-seen category order keeps value_counts ties in first-seen order, as for plain strings
+        df[column] = pd.Categorical(df[column], categories=df[column].unique())
+    df['price_value'] = pd.to_numeric(df['price_gross'], errors='coerce').fillna(0.0)
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def create_csv(df: pd.DataFrame) -> str:
+    """Convert products frame to CSV string."""
+    output = io.BytesIO()
+    output.write((';'.join(FIELDNAMES) + '\n').encode())
     
-    writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter=';')
-    writer.writeheader()
-    writer.writerows(products)
+    # Arrow serializes the columns in C++ without building Python rows
+    table = pa.Table.from_pandas(df[FIELDNAMES], preserve_index=False)
+    pacsv.write_csv(table, output, write_options=pacsv.WriteOptions(include_header=False, delimiter=';'))
     
-    return output.getvalue()
+    return output.getvalue().decode('utf-8')
 
 
 def check_password():
@@ -343,6 +555,25 @@ def check_password():
     return False
 
 
+def baselinker_session() -> requests.Session:
+    """Keep-alive HTTP session for BaseLinker calls, reused across reruns."""
+    if 'bl_session' not in st.session_state:
+        # Only retry when the request was not processed: connection failures,
+        # rate limiting and gateway errors (read=0 avoids re-sending after a timeout)
+        retries = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False
+        )
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retries))
+        st.session_state['bl_session'] = session
+    return st.session_state['bl_session']
+
+
 def baselinker_api_call(method: str, parameters: Dict) -> Dict:
     """Make a call to BaseLinker API"""
     if "baselinker_token" not in st.secrets:
@@ -351,69 +582,110 @@ def baselinker_api_call(method: str, parameters: Dict) -> Dict:
     url = 'https://api.baselinker.com/connector.php'
     payload = {
         'method': method,
-        'parameters': json.dumps(parameters)
+        'parameters': orjson.dumps(parameters).decode()
     }
-    data = parse.urlencode(payload).encode('utf-8')
     
     try:
-        req = urllib.request.Request(url, data=data, headers={
+        resp = baselinker_session().post(url, data=payload, headers={
             'X-BLToken': st.secrets["baselinker_token"]
-        })
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return json.loads(resp.read().decode('utf-8'))
+        }, timeout=30)
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
     except Exception as e:
         return {"status": "ERROR", "error": str(e)}
 
 
-def parse_natural_language_action(user_input: str) -> Tuple[Optional[str], Optional[Dict], str]:
+NLAction = Tuple[Optional[str], Optional[Dict], str]
+
+_DIGITS_RE = re.compile(r'\d+')
+_EAN_RE = re.compile(r'\d{8,13}')
+
+
+def _nl_list_products(user_input: str) -> NLAction:
+    """Get products / List products"""
+    inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
+    return "getInventoryProductsList", {"inventory_id": int(inventory_id), "page": 1}, "Listing products from inventory"
+
+
+def _nl_product_details(user_input: str) -> NLAction:
+    """Get product details by ID"""
+    match = _DIGITS_RE.search(user_input)
+    if match:
+        product_id = match.group()
+        inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
+        return "getInventoryProductsData", {
+            "inventory_id": int(inventory_id),
+            "products": [product_id]
+        }, f"Getting details for product {product_id}"
+    return None, None, "Please specify product ID (e.g., 'get product details 12345')"
+
+
+def _nl_inventories(user_input: str) -> NLAction:
+    """Get inventories"""
+    return "getInventories", {}, "Getting list of inventories"
+
+
+def _nl_categories(user_input: str) -> NLAction:
+    """Get categories"""
+    inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
+    return "getInventoryCategories", {"inventory_id": int(inventory_id)}, "Getting categories"
+
+
+def _nl_search_ean(user_input: str) -> NLAction:
+    """Search by EAN"""
+    match = _EAN_RE.search(user_input)
+    if match:
+        ean = match.group()
+        return "getInventoryProductsList", {
+            "inventory_id": int(st.secrets.get("baselinker_inventory_id", "81501")),
+            "filter_ean": ean,
+            "page": 1
+        }, f"Searching for product with EAN {ean}"
+    return None, None, "Please specify EAN number"
+
+
+def _nl_update_stock(user_input: str) -> NLAction:
+    """Update stock"""
+    return None, None, "Stock updates require: 'update stock [product_id] to [quantity]' (e.g., 'update stock 12345 to 50')"
+
+
+def _nl_warehouses(user_input: str) -> NLAction:
+    """Get warehouses"""
+    return "getInventoryWarehouses", {}, "Getting list of warehouses"
+
+
+# Keyword -> handler; longer phrases go before their prefixes ("get products" before "get product")
+_NL_ACTIONS = {
+    "list products": _nl_list_products,
+    "get products": _nl_list_products,
+    "show products": _nl_list_products,
+    "view products": _nl_list_products,
+    "product details": _nl_product_details,
+    "get product": _nl_product_details,
+    "inventories": _nl_inventories,
+    "list inventory": _nl_inventories,
+    "categories": _nl_categories,
+    "ean": _nl_search_ean,
+    "barcode": _nl_search_ean,
+    "update stock": _nl_update_stock,
+    "set stock": _nl_update_stock,
+    "warehouse": _nl_warehouses,
+}
+
+# One compiled alternation over all keywords; the lookahead reports overlapping matches too
+_INTENT_RE = re.compile(r'(?=\b(' + '|'.join(map(re.escape, _NL_ACTIONS)) + '))')
+
+# When several keywords appear, the one listed first in _NL_ACTIONS wins
+_NL_PRIORITY = {keyword: rank for rank, keyword in enumerate(_NL_ACTIONS)}
+
+
+def parse_natural_language_action(user_input: str) -> NLAction:
     """Parse natural language into BaseLinker API call"""
     user_input = user_input.lower().strip()
     
-    # Get products / List products
-    if any(word in user_input for word in ["list products", "get products", "show products", "view products"]):
-        inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
-        return "getInventoryProductsList", {"inventory_id": int(inventory_id), "page": 1}, "Listing products from inventory"
-    
-    # Get product details by ID
-    if "product details" in user_input or "get product" in user_input:
-        match = re.search(r'\d+', user_input)
-        if match:
-            product_id = match.group()
-            inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
-            return "getInventoryProductsData", {
-                "inventory_id": int(inventory_id),
-                "products": [product_id]
-            }, f"Getting details for product {product_id}"
-        return None, None, "Please specify product ID (e.g., 'get product details 12345')"
-    
-    # Get inventories
-    if "inventories" in user_input or "list inventory" in user_input:
-        return "getInventories", {}, "Getting list of inventories"
-    
-    # Get categories
-    if "categories" in user_input:
-        inventory_id = st.secrets.get("baselinker_inventory_id", "81501")
-        return "getInventoryCategories", {"inventory_id": int(inventory_id)}, "Getting categories"
-    
-    # Search by EAN
-    if "ean" in user_input or "barcode" in user_input:
-        match = re.search(r'\d{8,13}', user_input)
-        if match:
-            ean = match.group()
-            return "getInventoryProductsList", {
-                "inventory_id": int(st.secrets.get("baselinker_inventory_id", "81501")),
-                "filter_ean": ean,
-                "page": 1
-            }, f"Searching for product with EAN {ean}"
-        return None, None, "Please specify EAN number"
-    
-    # Update stock
-    if "update stock" in user_input or "set stock" in user_input:
-        return None, None, "Stock updates require: 'update stock [product_id] to [quantity]' (e.g., 'update stock 12345 to 50')"
-    
-    # Get warehouses
-    if "warehouse" in user_input:
-        return "getInventoryWarehouses", {}, "Getting list of warehouses"
+    keywords = _INTENT_RE.findall(user_input)
+    if keywords:
+        return _NL_ACTIONS[min(keywords, key=_NL_PRIORITY.__getitem__)](user_input)
     
     return None, None, "I don't understand that command. Try: 'list products', 'get inventories', 'get categories', 'search ean 1234567890'"
 
@@ -430,38 +702,29 @@ def xml_converter_tab():
         uploaded_file = st.file_uploader("Upload XML file", type=['xml'])
         
         if uploaded_file is not None:
-            xml_content = uploaded_file.read()
-            
-            # Try to detect format
-            st.info("Detecting XML format...")
             try:
-                root = ET.fromstring(xml_content)
-                
-                # Detect format
-                if root.tag == 'products' and root.find('.//product/producer') is not None:
-                    parser_type = "iof_format"
-                    st.success("✅ Detected: IOF 3.0 format")
-                elif root.tag == 'offer' and root.find('.//products/product') is not None:
-                    parser_type = "soteshop_format"
-                    st.success("✅ Detected: Soteshop format")
-                elif root.find('.//product') is not None:
-                    parser_type = "maxima_format"
-                    st.success("✅ Detected: Maxima format")
-                else:
-                    st.error("❌ Unknown XML format")
-                    return
+                last_upload = st.session_state.get('last_upload')
+                if last_upload is None or last_upload[0] != uploaded_file.file_id:
+                    # Parse the upload buffer in place rather than copying it out with .read()
+                    st.info("Detecting XML format...")
+                    parser_type = detect_xml_format(uploaded_file)
+                    uploaded_file.seek(0)
+                    
+                    if parser_type not in _PARSERS:
+                        st.error("❌ Unknown XML format")
+                        return
+                    products = _PARSERS[parser_type](uploaded_file)
+                    
+                    # Reruns (filter changes, downloads) reuse the parsed upload
+                    last_upload = (uploaded_file.file_id, parser_type, products_frame(products))
+                    st.session_state['last_upload'] = last_upload
                 
-                # Parse based on detected format
-                if parser_type == "iof_format":
-                    products = parse_iof_format(root)
-                elif parser_type == "soteshop_format":
-                    products = parse_soteshop_format(root)
-                else:
-                    products = parse_maxima_format(root)
+                _, parser_type, df = last_upload
+                st.success(f"✅ Detected: {FORMAT_LABELS[parser_type]} format")
                 
-                display_products_and_export(products, "Uploaded XML")
+                display_products_and_export(df, "Uploaded XML")
                 
-            except ET.ParseError as e:
+            except LET.XMLSyntaxError as e:
                 st.error(f"❌ XML Parse Error: {e}")
             except Exception as e:
                 st.error(f"❌ Error: {e}")
@@ -489,25 +752,86 @@ def xml_converter_tab():
         
         with col2:
             convert_button = st.button("🚀 Convert to CSV", type="primary", use_container_width=True)
+            fetch_all_button = st.button("⚡ Fetch All Suppliers", use_container_width=True)
+            refresh_button = st.button(
+                "🔄 Refresh",
+                help="Skip the 10-minute cache and check the feeds for fresh stock",
+                use_container_width=True
+            )
         
-        if convert_button:
-            products, error = fetch_and_parse(selected_supplier, config)
+        # Refresh repeats the current view with the cache cleared; feeds are revalidated
+        # with the server, so unchanged ones still skip the download
+        if refresh_button:
+            fetch_products.clear()
+            fetch_all_button = 'last_fetch_all' in st.session_state
+            convert_button = not fetch_all_button
+        
+        # Results are kept in session state so filter changes and downloads, which
+        # rerun the script, reuse them instead of fetching again
+        if fetch_all_button:
+            st.session_state['last_fetch_all'] = fetch_all_suppliers()
+            st.session_state.pop('last_products', None)
+        elif convert_button:
+            products, fetched_at, error = fetch_and_parse(selected_supplier, config)
             
             if error:
                 st.error(f"❌ Error: {error}")
                 return
             
-            if not products:
-                st.warning("⚠️ No products found in XML feed")
-                return
-            
-            display_products_and_export(products, selected_supplier)
+            st.session_state['last_products'] = (selected_supplier, fetched_at, products_frame(products))
+            st.session_state.pop('last_fetch_all', None)
+        
+        if 'last_fetch_all' in st.session_state:
+            results = st.session_state['last_fetch_all']
+            fetch_times = [fetched_at for _, fetched_at, error in results.values() if not error]
+            if fetch_times:
+                st.caption(f"Oldest feed fetched at {datetime.fromtimestamp(min(fetch_times)):%H:%M:%S}")
+            display_all_suppliers(results)
+            return
+        
+        last_products = st.session_state.get('last_products')
+        if last_products is None or last_products[0] != selected_supplier:
+            return
+        
+        _, fetched_at, df = last_products
+        if df.empty:
+            st.warning("⚠️ No products found in XML feed")
+            return
+        
+        st.caption(f"Fetched at {datetime.fromtimestamp(fetched_at):%H:%M:%S}")
+        display_products_and_export(df, selected_supplier)
 
 
-def display_products_and_export(products: List[Dict], source_name: str):
+def display_all_suppliers(results: Dict[str, Tuple[Dict[str, List], Optional[float], Optional[str]]]):
+    """Display per-supplier results of a fetch-all run with CSV downloads"""
+    st.dataframe([
+        {
+            "Supplier": name,
+            "Products": len(products.get('product_id', [])),
+            "Fetched": f"{datetime.fromtimestamp(fetched_at):%H:%M:%S}" if fetched_at else "",
+            "Status": f"❌ {error}" if error else "✅ OK"
+        }
+        for name, (products, fetched_at, error) in results.items()
+    ], use_container_width=True)
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for name, (products, _, error) in results.items():
+        if error or not products['product_id']:
+            continue
+        st.download_button(
+            label=f"⬇️ {name} CSV",
+            data=create_csv(pd.DataFrame(products, columns=FIELDNAMES)),
+            file_name=f"{name.lower().replace(' ', '_')}_{timestamp}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+
+
+def display_products_and_export(df: pd.DataFrame, source_name: str):
     """Display products with filters and export options"""
-    # Get unique producers for dropdown
-    unique_producers = sorted(set(p['producer'] for p in products))
+    # One counting pass serves the dropdown, the metric and the breakdown (most common first)
+    producer_counts = df['producer'].value_counts()
+    unique_producers = sorted(producer_counts.index)
     
     # Filters in sidebar
     st.sidebar.subheader("Filters")
@@ -525,39 +849,39 @@ def display_products_and_export(products: List[Dict], source_name: str):
         help="Only show products with stock >= this value"
     )
     
+    # Numeric columns are derived once at parse time; unparseable values count as 0
+    stock = df['stock']
+    price = df['price_value']
+    
     # Apply filters
-    filtered_products = products
+    mask = np.ones(len(df), dtype=bool)
     
     if filter_producer != "All Producers":
-        filtered_products = [
-            p for p in filtered_products 
-            if p['producer'] == filter_producer
-        ]
+        mask &= (df['producer'] == filter_producer).to_numpy()
     
     if filter_min_stock > 0:
-        filtered_products = [
-            p for p in filtered_products 
-            if int(float(p.get('stock', 0))) >= filter_min_stock
-        ]
+        mask &= (stock >= filter_min_stock).to_numpy()
+    
+    filtered = df[mask]
     
     # Display statistics
-    st.success(f"✅ Successfully parsed {len(products)} products")
+    st.success(f"✅ Successfully parsed {len(df)} products")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.metric("Total Products", len(products))
+        st.metric("Total Products", len(df))
     
     with col2:
-        products_with_stock = sum(1 for p in products if int(float(p.get('stock', 0))) > 0)
+        products_with_stock = int((stock > 0).sum())
         st.metric("With Stock", products_with_stock)
     
     with col3:
-        unique_producers_count = len(set(p['producer'] for p in products))
+        unique_producers_count = len(producer_counts)
         st.metric("Unique Producers", unique_producers_count)
     
     with col4:
-        st.metric("After Filters", len(filtered_products))
+        st.metric("After Filters", len(filtered))
     
     # Tabs for different views
     tab1, tab2, tab3 = st.tabs(["📊 Summary", "📋 Data Preview", "🏭 Producers"])
@@ -565,8 +889,8 @@ def display_products_and_export(products: List[Dict], source_name: str):
     with tab1:
         st.subheader("Summary Statistics")
         
-        total_stock = sum(int(float(p.get('stock', 0))) for p in filtered_products)
-        avg_price = sum(float(p.get('price', 0)) for p in filtered_products) / len(filtered_products) if filtered_products else 0
+        total_stock = int(stock[mask].sum())
+        avg_price = float(price[mask].mean()) if len(filtered) else 0
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -574,59 +898,47 @@ def display_products_and_export(products: List[Dict], source_name: str):
         with col2:
             st.metric("Avg Price", f"{avg_price:.2f} PLN")
         with col3:
-            avg_stock = total_stock / len(filtered_products) if filtered_products else 0
+            avg_stock = total_stock / len(filtered) if len(filtered) else 0
             st.metric("Avg Stock/Product", f"{avg_stock:.1f}")
     
     with tab2:
         st.subheader("Product Data Preview")
-        if filtered_products:
-            # Convert to dataframe-like display
-            preview_data = []
-            for p in filtered_products[:50]:  # Show first 50
-                preview_data.append({
-                    "EAN": p.get('ean', ''),
-                    "Name": p.get('name', '')[:50] + "..." if len(p.get('name', '')) > 50 else p.get('name', ''),
-                    "Producer": p.get('producer', ''),
-                    "Stock": int(float(p.get('stock', 0))),
-                    "Price": f"{float(p.get('price', 0)):.2f}"
-                })
+        if len(filtered):
+            # Build the preview column-wise from the first 50 rows
+            head = filtered.head(50).reset_index(drop=True)
+            names = head['name']
+            preview_data = pd.DataFrame({
+                "EAN": head['ean'],
+                "Name": names.where(names.str.len() <= 50, names.str.slice(0, 50) + "..."),
+                "Producer": head['producer'],
+                "Stock": head['stock'],
+                "Price": head['price_value'].map('{:.2f}'.format)
+            })
             st.dataframe(preview_data, use_container_width=True, height=400)
-            if len(filtered_products) > 50:
-                st.info(f"Showing first 50 of {len(filtered_products)} products. Download CSV for full data.")
+            if len(filtered) > 50:
+                st.info(f"Showing first 50 of {len(filtered)} products. Download CSV for full data.")
         else:
             st.info("No products match the current filters")
     
     with tab3:
         st.subheader("📊 Producer Breakdown")
-        if products:
-            producer_counts = {}
-            producer_stock = {}
-            for p in products:
-                prod = p['producer']
-                stock = int(float(p.get('stock', 0)))
-                if prod not in producer_counts:
-                    producer_counts[prod] = 0
-                    producer_stock[prod] = 0
-                producer_counts[prod] += 1
-                producer_stock[prod] += stock
+        if len(df):
+            producer_stock = stock.groupby(df['producer'], observed=True).sum().reindex(producer_counts.index)
             
-            producer_data = [
-                {
-                    "Producer": k,
-                    "Products": v,
-                    "Total Stock": producer_stock[k],
-                    "Avg Stock": f"{producer_stock[k] / v:.1f}"
-                }
-                for k, v in sorted(producer_counts.items(), key=lambda x: -x[1])
-            ]
+            producer_data = pd.DataFrame({
+                "Producer": producer_counts.index,
+                "Products": producer_counts.to_numpy(),
+                "Total Stock": producer_stock.to_numpy(),
+                "Avg Stock": (producer_stock / producer_counts).map('{:.1f}'.format).to_numpy()
+            })
             st.dataframe(producer_data, use_container_width=True)
     
     # CSV Export
     st.markdown("---")
     st.subheader("📥 Download CSV")
     
-    if filtered_products:
-        csv_data = create_csv(filtered_products)
+    if len(filtered):
+        csv_data = create_csv(filtered)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{source_name.lower().replace(' ', '_')}_{timestamp}.csv"
         